@@ -26,17 +26,23 @@ import argparse
 import re
 import time
 import xmlrpc.client
-from math import atan2, cos, radians, sin, sqrt
-from threading import Lock, Thread
+from bisect import bisect_right
+from functools import lru_cache
+from math import asin, cos, radians, sin, sqrt
+from queue import SimpleQueue
+from threading import Event, Lock, Thread
 
 import requests
 
 from rich.logging import RichHandler
 from rich.traceback import install
 from rich import print  # pylint: disable=redefined-builtin
-from rich.console import Console
+from rich.console import Console, Group
+from rich.live import Live
+from rich.rule import Rule
+from rich.text import Text
 
-from bs4 import BeautifulSoup as bs
+from lxml import html
 
 from bandmap.lib.database import DataBase
 from bandmap.lib.telnetlib import Telnet
@@ -154,12 +160,17 @@ else:
 server = xmlrpc.client.ServerProxy(f"http://{FLRIG_HOST}:{FLRIG_PORT}")
 
 lock = Lock()
+vfo_changed = Event()
+spots_changed = Event()
+spot_queue = SimpleQueue()
 console = Console(width=38)
 localspotters = []
 THE_VFO = 0.0
-OLD_VFO = 0.0
 CONTACTLIST = {}
-RBN_PARSER = r"^DX de ([A-Z\d\-\/]*)-#:\s+([\d.]*)\s+([A-Z\d\-\/]*)\s+([A-Z\d]*)\s+(\d*) dB.*\s+(\d{4}Z)"  # pylint: disable=line-too-long
+CONTACTS_TOKEN = None
+RBN_PARSER = re.compile(
+    r"^DX de ([A-Z\d\-\/]*)-#:\s+([\d.]*)\s+([A-Z\d\-\/]*)\s+([A-Z\d]*)\s+(\d*) dB.*\s+(\d{4}Z)"  # pylint: disable=line-too-long
+)
 database = DataBase(LOG_DB_NAME)
 
 
@@ -167,43 +178,55 @@ def updatecontactlist():
     """
     Scans the loggers database and builds a callsign on band dictionary
     so the spots can be flagged red so you know you can bypass them on the bandmap.
+    Skips the rebuild if the log has not changed since the last scan.
     """
-    global CONTACTLIST
+    global CONTACTLIST, CONTACTS_TOKEN
+    token = database.get_contacts_token()
+    if token == CONTACTS_TOKEN:
+        return
+    CONTACTS_TOKEN = token
     CONTACTLIST = {}
     result = database.get_contacts()
     for contact in result:
-        band = contact.get("band")
+        # Key on the integer band, the same type the spots table hands back.
+        try:
+            band = int(contact.get("band"))
+        except (ValueError, TypeError):
+            continue
         callsign = contact.get("callsign")
-
-        if band in CONTACTLIST:
-            CONTACTLIST[band].append(callsign)
-        else:
-            CONTACTLIST[band] = list()
-            CONTACTLIST[band].append(callsign)
+        CONTACTLIST.setdefault(band, set()).add(callsign)
 
 
 def alreadyworked(callsign, band):
     """
     Check if callsign has already been worked on band.
     """
-    if str(band) in CONTACTLIST:
-        return callsign in CONTACTLIST[str(band)]
-    return False
+    return callsign in CONTACTLIST.get(band, ())
 
 
 def getvfo():
     """
     Get the freq from the active VFO in khz.
+    Polls every 0.25 seconds while the VFO is being tuned, once a second otherwise.
+    Sets vfo_changed when the frequency moves.
     """
     global THE_VFO
+    last_change = 0.0
     while True:
         try:
-            THE_VFO = float(server.rig.get_vfo()) / 1000
+            vfo = float(server.rig.get_vfo()) / 1000
         except ValueError:
-            THE_VFO = 0.0
+            vfo = 0.0
         except TypeError:
-            THE_VFO = 0.0
-        time.sleep(0.25)
+            vfo = 0.0
+        if vfo != THE_VFO:
+            THE_VFO = vfo
+            last_change = time.monotonic()
+            vfo_changed.set()
+        if time.monotonic() - last_change < 2:
+            time.sleep(0.25)
+        else:
+            time.sleep(1)
 
 
 def comparevfo(freq):
@@ -220,211 +243,260 @@ def comparevfo(freq):
     return difference
 
 
-def gridtolatlon(maiden):
-    """
-    Convert a 2,4,6 or 8 character maidenhead gridsquare to a latitude longitude pair.
-    """
-    maiden = str(maiden).strip().upper()
+def grid2_to_latlon(grid):
+    """Latitude longitude pair of a 2 character gridsquare given as bytes."""
+    return (grid[1] - 65) * 10 - 90, (grid[0] - 65) * 20 - 180
 
-    maidenhead_resolution = len(maiden)
-    if not 8 >= maidenhead_resolution >= 2 and maidenhead_resolution % 2 == 0:
-        return 0, 0
 
-    lon = (ord(maiden[0]) - 65) * 20 - 180
-    lat = (ord(maiden[1]) - 65) * 10 - 90
+def grid4_to_latlon(grid):
+    """Latitude longitude pair of a 4 character gridsquare given as bytes."""
+    return (
+        (grid[1] - 65) * 10 - 90 + grid[3] - 48,
+        (grid[0] - 65) * 20 - 180 + (grid[2] - 48) * 2,
+    )
 
-    if maidenhead_resolution >= 4:
-        lon += (ord(maiden[2]) - 48) * 2
-        lat += ord(maiden[3]) - 48
 
-    if maidenhead_resolution >= 6:
-        lon += (ord(maiden[4]) - 65) / 12 + 1 / 24
-        lat += (ord(maiden[5]) - 65) / 24 + 1 / 48
+def grid6_to_latlon(grid):
+    """Latitude longitude pair of a 6 character gridsquare given as bytes."""
+    return (
+        (grid[1] - 65) * 10 - 90 + grid[3] - 48 + (grid[5] - 65) / 24 + 1 / 48,
+        (grid[0] - 65) * 20 - 180 + (grid[2] - 48) * 2 + (grid[4] - 65) / 12 + 1 / 24,
+    )
 
-    if maidenhead_resolution >= 8:
-        lon += (ord(maiden[6])) * 5.0 / 600
-        lat += (ord(maiden[7])) * 2.5 / 600
 
-    return lat, lon
+def grid8_to_latlon(grid):
+    """Latitude longitude pair of a 8 character gridsquare given as bytes."""
+    lat, lon = grid6_to_latlon(grid)
+    return lat + (grid[7] - 48) * 2.5 / 600, lon + (grid[6] - 48) * 5.0 / 600
+
+
+GRID_DECODERS = {
+    2: grid2_to_latlon,
+    4: grid4_to_latlon,
+    6: grid6_to_latlon,
+    8: grid8_to_latlon,
+}
+
+
+@lru_cache(maxsize=4096)
+def gridtolatlon(maiden):
+    """
+    Convert a 2,4,6 or 8 character maidenhead gridsquare to a latitude longitude pair.
+    Returns 0, 0 for anything else.
+    """
+    try:
+        grid = str(maiden).strip().upper().encode("ascii")
+    except UnicodeEncodeError:
+        return 0, 0
+    decoder = GRID_DECODERS.get(len(grid))
+    if decoder is None:
+        return 0, 0
+    return decoder(grid)
+
+
+MY_LAT, MY_LON = gridtolatlon(MY_GRID)
+
+
+# (lower edge, upper edge, band) in khz, sorted by frequency.
+BANDS = (
+    (1800, 2000, "160"),
+    (3500, 4000, "80"),
+    (5330, 5406, "60"),
+    (7000, 7300, "40"),
+    (10100, 10150, "30"),
+    (14000, 14350, "20"),
+    (18068, 18168, "17"),
+    (21000, 21450, "15"),
+    (24890, 24990, "12"),
+    (28000, 29700, "10"),
+    (50000, 54000, "6"),
+    (144000, 148000, "2"),
+)
+# Flattened edges for bisect. An odd insertion point lands inside a band.
+BAND_EDGES = tuple(edge for lower, upper, _ in BANDS for edge in (lower, upper))
+BAND_NAMES = ("0",) + tuple(name for _, _, band in BANDS for name in (band, "0"))
 
 
 def getband(freq):
     """
-    Convert a (float) frequency into a (string) band.
+    Convert a (float) frequency in khz into a (string) band.
     Returns a (string) band.
     Returns a "0" if frequency is out of band.
     """
     try:
-        frequency = int(float(freq)) * 1000
-    except ValueError:
-        frequency = 0.0
-    except TypeError:
-        frequency = 0.0
-    if frequency > 1800000 and frequency < 2000000:
-        return "160"
-    if frequency > 3500000 and frequency < 4000000:
-        return "80"
-    if frequency > 5330000 and frequency < 5406000:
-        return "60"
-    if frequency > 7000000 and frequency < 7300000:
-        return "40"
-    if frequency > 10100000 and frequency < 10150000:
-        return "30"
-    if frequency > 14000000 and frequency < 14350000:
-        return "20"
-    if frequency > 18068000 and frequency < 18168000:
-        return "17"
-    if frequency > 21000000 and frequency < 21450000:
-        return "15"
-    if frequency > 24890000 and frequency < 24990000:
-        return "12"
-    if frequency > 28000000 and frequency < 29700000:
-        return "10"
-    if frequency > 50000000 and frequency < 54000000:
-        return "6"
-    if frequency > 144000000 and frequency < 148000000:
-        return "2"
-
-    return "0"
-
-
-def calc_distance(grid1, grid2):
+        return BAND_NAMES[bisect_right(BAND_EDGES, int(float(freq)))]
+    except (ValueError, TypeError):
+        return "0"
+
+
+def calc_distances(grids, lat1, long1):
     """
-    Takes two maidenhead gridsquares and returns the distance between the two in kilometers.
+    Takes a list of maidenhead gridsquares and a reference latitude longitude pair
+    and returns a list of distances in kilometers from the reference to each entry.
     """
     earth_radius = 6371
-    lat1, long1 = gridtolatlon(grid1)
-    lat2, long2 = gridtolatlon(grid2)
-
-    d_lat = radians(lat2) - radians(lat1)
-    d_long = radians(long2) - radians(long1)
-
     r_lat1 = radians(lat1)
-    # r_long1 = radians(long1)
-    r_lat2 = radians(lat2)
-    # r_long2 = radians(long2)
-
-    the_a = sin(d_lat / 2) * sin(d_lat / 2) + cos(r_lat1) * cos(r_lat2) * sin(
-        d_long / 2
-    ) * sin(d_long / 2)
-    the_c = 2 * atan2(sqrt(the_a), sqrt(1 - the_a))
-    the_distance = earth_radius * the_c  # distance in km
-
-    return the_distance
+    r_long1 = radians(long1)
+    cos_lat1 = cos(r_lat1)
+
+    distances = []
+    for lat2, long2 in map(gridtolatlon, grids):
+        r_lat2 = radians(lat2)
+        sin_d_lat = sin((r_lat2 - r_lat1) / 2)
+        sin_d_long = sin((radians(long2) - r_long1) / 2)
+        the_a = sin_d_lat * sin_d_lat + cos_lat1 * cos(r_lat2) * sin_d_long * sin_d_long
+        # min() guards against rounding pushing the_a past 1 for antipodal points.
+        the_c = 2 * asin(min(1.0, sqrt(the_a)))
+        distances.append(earth_radius * the_c)  # distance in km
+
+    return distances
+
+
+# (lower edge, upper edge) in khz of the General class CW/data segments.
+GENERAL_SEGMENTS = (
+    (1800, 2000),
+    (3525, 3600),
+    (3800, 4000),
+    (7025, 7125),
+    (7175, 7300),
+    (10100, 10150),
+    (14025, 14150),
+    (14225, 14350),
+    (18068, 18168),
+    (21025, 21200),
+    (21275, 21450),
+    (24890, 24990),
+    (28000, 29700),
+    (50000, 54000),
+)
+GENERAL_EDGES = tuple(edge for segment in GENERAL_SEGMENTS for edge in segment)
 
 
 def inband(freq):
     """
     Returns True if the frequency is within the General portion of the band.
     """
-    in_band = False
-    if freq > 1800 and freq < 2000:
-        in_band = True
-    if freq > 3525 and freq < 3600:
-        in_band = True
-    if freq > 3800 and freq < 4000:
-        in_band = True
-    if freq > 7025 and freq < 7125:
-        in_band = True
-    if freq > 7175 and freq < 7300:
-        in_band = True
-    if freq > 10100 and freq < 10150:
-        in_band = True
-    if freq > 14025 and freq < 14150:
-        in_band = True
-    if freq > 14225 and freq < 14350:
-        in_band = True
-    if freq > 18068 and freq < 18168:
-        in_band = True
-    if freq > 21025 and freq < 21200:
-        in_band = True
-    if freq > 21275 and freq < 21450:
-        in_band = True
-    if freq > 24890 and freq < 24990:
-        in_band = True
-    if freq > 28000 and freq < 29700:
-        in_band = True
-    if freq > 50000 and freq < 54000:
-        in_band = True
-    return in_band
-
-
-def showspots(the_lock):
+    return bisect_right(GENERAL_EDGES, freq) % 2 == 1
+
+
+# Spot highlight by distance in khz from the VFO: < 0.2, < 0.5, < 0.8, further.
+VFO_EDGES = (0.2, 0.5, 0.8)
+VFO_STYLES = ("bold on blue", "bold on color(240)", "bold on color(237)", "")
+# callsign, frequency, band, time, age in seconds
+SPOT_FORMAT = "{:<11} {:>8} {:>3}M {} {}"
+
+
+def showspots(the_lock, live):
     """
     Show spot list, sorted by frequency.
     Prune the list if it's longer than the window by removing the oldest spots.
     If tracking your VFO highlight those spots in/near your bandpass.
     Mark those already worked in red.
+    Only rereads the spots when they have changed, and only repaints the screen
+    when what would be shown has changed.
+    Draws through live, which run() starts and stops.
     """
+    last_view = None
+    result = []
+    fetched = time.monotonic()
     while True:
         updatecontactlist()
-        console.clear()
-        console.rule(f"[bold red]Spots VFO: {THE_VFO}")
-        with the_lock:
-            result = DataBase.getspots()
+        if spots_changed.is_set():
+            spots_changed.clear()
+            with the_lock:
+                result = database.getspots()
+            fetched = time.monotonic()
+        # Age the cached spots by the time since they were read.
+        aged = int(time.monotonic() - fetched)
+        lines = []
         displayed = 2
         for spot in result:
-            _, callsign, date_time, frequency, band, delta = spot
+            callsign, date_time, frequency, band, delta = spot
+            delta += aged
             displayed += 1
             if displayed > console.height:
                 with the_lock:
-                    DataBase.prune_oldest_spot()
+                    database.prune_oldest_spot()
+                spots_changed.set()
             else:
-                if inband(frequency):
-                    style = ""
-                else:
-                    style = ""  # if in extra/advanced band
-                if comparevfo(frequency) < 0.8:
-                    style = "bold on color(237)"
-                if comparevfo(frequency) < 0.5:
-                    style = "bold on color(240)"
-                if comparevfo(frequency) < 0.2:
-                    style = "bold on blue"
+                style = VFO_STYLES[bisect_right(VFO_EDGES, comparevfo(frequency))]
                 if alreadyworked(callsign, band):
                     style = "bold on color(88)"
-                console.print(
-                    (
-                        f"{callsign.ljust(11)} {str(frequency).rjust(8)} "
-                        f"{str(band).rjust(3)}M {date_time.split()[1]} {delta}"
-                    ),
-                    style=style,
-                    overflow="ellipsis",
+                # date_time is "YYYY-MM-DD HH:MM:SS", show the time.
+                line = SPOT_FORMAT.format(
+                    callsign, frequency, band, date_time[11:19], delta
                 )
-        time.sleep(1)
+                lines.append((line, style))
+        view = (THE_VFO, tuple(lines))
+        if view != last_view:
+            last_view = view
+            live.update(
+                Group(
+                    Rule(f"[bold red]Spots VFO: {THE_VFO}"),
+                    *(
+                        Text(line, style=style, overflow="ellipsis")
+                        for line, style in lines
+                    ),
+                ),
+                refresh=True,
+            )
+        # Wake early when the VFO moves so the highlight follows tuning.
+        vfo_changed.wait(1)
+        vfo_changed.clear()
 
 
-def getrbn(the_lock):
-    """Thread to get RBN spots"""
+def writespots(the_lock):
+    """
+    Thread to store the lists of spots queued by getrbn.
+    Everything waiting in the queue is written in one batch.
+    """
+    while True:
+        spots = spot_queue.get()
+        while not spot_queue.empty():
+            spots.extend(spot_queue.get_nowait())
+        with the_lock:
+            database.add_spots(spots, SPOT_TO_OLD)
+        spots_changed.set()
+
+
+def getrbn():
+    """Thread to get RBN spots, queues them for writespots"""
+    pending = b""
     with Telnet(RBN_SERVER, RBN_PORT) as tn_connection:
         while True:
-            stream = tn_connection.read_until(b"\r\n", timeout=1.0)
+            stream = pending + tn_connection.read_until(b"\r\n", timeout=1.0)
+            # read_until stops at the first line, pick up whatever else has
+            # already arrived so a burst of spots is handled as one batch.
+            stream += tn_connection.read_very_eager()
             if stream == b"":
                 continue
-            stream = stream.decode()
-            if "Please enter your call:" in stream:
+            if b"Please enter your call:" in stream:
+                pending = b""
                 tn_connection.write(f"{MY_CALL}\r\n".encode("ascii"))
                 continue
-            data = stream.split("\r\n")
+            # Hold back a trailing partial line until the rest of it arrives.
+            stream, _, pending = stream.rpartition(b"\r\n")
+            spots = []
+            data = stream.decode().split("\r\n")
             for entry in data:
                 if not entry:
                     continue
-                parsed = list(re.findall(RBN_PARSER, entry.strip()))
-                if not parsed or len(parsed[0]) < 6:
+                parsed = RBN_PARSER.match(entry.strip())
+                if not parsed:
                     continue
-                spotter = parsed[0][0]
-                mode = parsed[0][3]
+                spotter, freq, callsign, mode, _, _ = parsed.groups()
                 if not mode == "CW":
                     continue
                 if not spotter in localspotters:
                     continue
-                freq = float(parsed[0][1])
+                freq = float(freq)
                 band = getband(freq)
-                callsign = parsed[0][2]
-                if not inband(float(freq)) and SHOW_OUT_OF_BAND is False:
+                if not inband(freq) and SHOW_OUT_OF_BAND is False:
                     continue
                 if band in LIMIT_BANDS:
-                    with the_lock:
-                        DataBase.add_spot(callsign, freq, band, SPOT_TO_OLD)
+                    spots.append((callsign, freq, band))
+            if spots:
+                spot_queue.put(spots)
 
 
 def run():
@@ -435,34 +507,47 @@ def run():
     page = requests.get(
         "http://reversebeacon.net/cont_includes/status.php?t=skt", timeout=10.0
     )
-    soup = bs(page.text, "lxml")
-    rows = soup.find_all("tr", {"class": "online"})
+    tree = html.fromstring(page.content)
+    rows = [row for row in tree.find_class("online") if row.tag == "tr"]
+    spotters = []
+    grids = []
     for row in rows:
-        datum = row.find_all("td")
-        spotter = datum[0].a.contents[0].strip()
-        # bands = datum[1].contents[0].strip()
-        grid = datum[2].contents[0]
-        distance = calc_distance(grid, MY_GRID) / 1.609
-        if distance < MAX_SPOTTER_DISTANCE:
+        datum = row.findall("td")
+        spotters.append(datum[0].find(".//a").text.strip())
+        # bands = datum[1].text.strip()
+        grids.append(datum[2].text)
+    for spotter, distance in zip(spotters, calc_distances(grids, MY_LAT, MY_LON)):
+        if distance / 1.609 < MAX_SPOTTER_DISTANCE:
             localspotters.append(spotter)
 
     print(f"Spotters with in {MAX_SPOTTER_DISTANCE} mi:")
     print(f"{localspotters}")
     time.sleep(1)
-    DataBase.setup_spots_db(SPOT_TO_OLD)
+    database.setup_spots_db(SPOT_TO_OLD)
 
     # Threading Oh my!
-    thread_1 = Thread(target=getrbn, args=(lock,))
+    thread_1 = Thread(target=getrbn)
     thread_1.daemon = True
-    thread_2 = Thread(target=showspots, args=(lock,))
+    # The Live display is owned here rather than in the daemon showspots thread,
+    # so stopping it restores the terminal when Ctrl-C ends the program.
+    live = Live(console=console, auto_refresh=False, screen=True)
+    thread_2 = Thread(target=showspots, args=(lock, live))
     thread_2.daemon = True
     thread_3 = Thread(target=getvfo)
     thread_3.daemon = True
+    thread_4 = Thread(target=writespots, args=(lock,))
+    thread_4.daemon = True
 
-    thread_1.start()
-    thread_2.start()
-    thread_3.start()
-
-    thread_1.join()
-    thread_2.join()
-    thread_3.join()
+    live.start()
+    try:
+        thread_1.start()
+        thread_2.start()
+        thread_3.start()
+        thread_4.start()
+
+        thread_1.join()
+        thread_2.join()
+        thread_3.join()
+        thread_4.join()
+    finally:
+        live.stop()
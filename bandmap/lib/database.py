@@ -5,6 +5,7 @@ GPL V3
 """
 
 import sqlite3
+import time
 
 if __name__ == "__main__":
     print("I'm not the program you are looking for.")
@@ -13,9 +14,44 @@ if __name__ == "__main__":
 class DataBase:
     """Database class for our database."""
 
+    AGED_PRUNE_INTERVAL = 5  # seconds between removals of aged out spots
+
+    # Constant statement text lets sqlite3 reuse the compiled statements
+    # from the connection's statement cache, values are always bound.
+    SQL_CREATE_SPOTS = (
+        "CREATE TABLE IF NOT EXISTS spots (callsign text PRIMARY KEY, "
+        "date_time text NOT NULL, frequency REAL NOT NULL, band INTEGER);"
+    )
+    SQL_GET_SPOTS = (
+        "select *, Cast ("
+        "(JulianDay(datetime('now')) - JulianDay(date_time)) * 24 * 60 * 60 As Integer"
+        ") from spots order by frequency asc"
+    )
+    SQL_PRUNE_AGED = (
+        "delete from spots where Cast "
+        "((JulianDay(datetime('now')) - JulianDay(date_time)) * 24 * 60 * 60 As Integer) "
+        "> ?"
+    )
+    SQL_PRUNE_OLDEST = (
+        "delete from spots where callsign = "
+        "(select callsign from spots order by date_time asc limit 1)"
+    )
+    SQL_UPSERT_SPOT = (
+        "INSERT INTO spots(callsign, date_time, frequency, band) "
+        "VALUES(?,datetime('now'),?,?) "
+        "ON CONFLICT(callsign) DO UPDATE SET frequency=excluded.frequency, "
+        "date_time=excluded.date_time, band=excluded.band"
+    )
+
     def __init__(self, database):
         """initializes DataBase instance"""
         self.database = database
+        # The spots table only lives as long as the program, keep it in memory
+        # on one connection shared by the threads. Callers serialize with a lock.
+        self.spots_conn = sqlite3.connect(
+            ":memory:", check_same_thread=False, isolation_level=None
+        )
+        self.last_aged_prune = 0.0
 
     @staticmethod
     def row_factory(cursor, row):
@@ -40,83 +76,46 @@ class DataBase:
             cursor.execute("select * from contacts where mode='CW'")
             return cursor.fetchall()
 
-    @staticmethod
-    def getspots():
+    def get_contacts_token(self) -> tuple:
+        """
+        returns a cheap (max rowid, count) pair for the CW contacts
+        that changes whenever contacts are logged or deleted.
+        """
+        with sqlite3.connect(self.database) as conn:
+            cursor = conn.cursor()
+            cursor.execute("select max(rowid), count(*) from contacts where mode='CW'")
+            return cursor.fetchone()
+
+    def getspots(self):
         """Return list of spots"""
-        with sqlite3.connect("spots.db") as db_context:
-            db_cursor = db_context.cursor()
-            sql = (
-                "select *, Cast ("
-                "(JulianDay(datetime('now')) - JulianDay(date_time)) * 24 * 60 * 60 As Integer"
-                ") from spots order by frequency asc"
-            )
-            db_cursor.execute(sql)
-            return db_cursor.fetchall()
+        db_cursor = self.spots_conn.cursor()
+        db_cursor.execute(self.SQL_GET_SPOTS)
+        return db_cursor.fetchall()
 
-    @staticmethod
-    def setup_spots_db(spot_to_old):
+    def setup_spots_db(self, spot_to_old):
         """Setup spots db"""
-        with sqlite3.connect("spots.db") as db_context:
-            db_cursor = db_context.cursor()
-            sql_table = (
-                "CREATE TABLE IF NOT EXISTS spots (id INTEGER PRIMARY KEY, callsign text, "
-                "date_time text NOT NULL, frequency REAL NOT NULL, band INTEGER);"
-            )
-            db_cursor.execute(sql_table)
-            sql = (
-                "delete from spots where Cast "
-                "((JulianDay(datetime('now')) - JulianDay(date_time)) * 24 * 60 * 60 As Integer) "
-                f"> {spot_to_old}"
-            )
-            db_cursor.execute(sql)
-            db_context.commit()
+        db_cursor = self.spots_conn.cursor()
+        db_cursor.execute(self.SQL_CREATE_SPOTS)
+        db_cursor.execute(self.SQL_PRUNE_AGED, (spot_to_old,))
 
-    @staticmethod
-    def prune_oldest_spot():
+    def prune_oldest_spot(self):
         """
         Removes the oldest spot.
         """
-        with sqlite3.connect("spots.db") as db_context:
-            db_cursor = db_context.cursor()
-            sql = "select * from spots order by date_time asc"
-            db_cursor.execute(sql)
-            result = db_cursor.fetchone()
-            spot_index, _, _, _, _ = result
-            sql = f"delete from spots where id='{spot_index}'"
-            db_cursor.execute(sql)
-            db_context.commit()
+        db_cursor = self.spots_conn.cursor()
+        db_cursor.execute(self.SQL_PRUNE_OLDEST)
 
-    @staticmethod
-    def add_spot(callsign, freq, band, spot_to_old):
+    def add_spots(self, spots, spot_to_old):
         """
-        Removes spots older than value stored in spottoold.
-        Inserts a new or updates existing spot.
+        Inserts new or updates existing spots from a list of
+        (callsign, freq, band) tuples in one transaction.
+        Every AGED_PRUNE_INTERVAL seconds also removes spots older than spot_to_old.
         """
-        with sqlite3.connect("spots.db") as db_context:
-            spot = (callsign, freq, band)
-            db_cursor = db_context.cursor()
-            sql = (
-                "delete from spots where Cast ("
-                "(JulianDay(datetime('now')) - JulianDay(date_time)"
-                f") * 24 * 60 * 60 As Integer) > {spot_to_old}"
-            )
-            db_cursor.execute(sql)
-            db_context.commit()
-            sql = f"select count(*) from spots where callsign='{callsign}'"
-            db_cursor.execute(sql)
-            result = db_cursor.fetchall()
-            if result[0][0] == 0:
-                sql = (
-                    "INSERT INTO spots(callsign, date_time, frequency, band) "
-                    "VALUES(?,datetime('now'),?,?)"
-                )
-                db_cursor.execute(sql, spot)
-                db_context.commit()
-            else:
-                sql = (
-                    "update spots "
-                    f"set frequency='{freq}', date_time = datetime('now'), band='{band}' "
-                    f"where callsign='{callsign}';"
-                )
-                db_cursor.execute(sql)
-                db_context.commit()
+        db_cursor = self.spots_conn.cursor()
+        with self.spots_conn:
+            db_cursor.execute("BEGIN")
+            now = time.monotonic()
+            if now - self.last_aged_prune >= self.AGED_PRUNE_INTERVAL:
+                self.last_aged_prune = now
+                db_cursor.execute(self.SQL_PRUNE_AGED, (spot_to_old,))
+            db_cursor.executemany(self.SQL_UPSERT_SPOT, spots)